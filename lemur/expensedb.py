@@ -1,7 +1,11 @@
+import hashlib
 import io
 import sqlite3
-from typing import Any, Dict, List, Optional
-from datetime import datetime, timezone
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 
 
 # Register the adapter and converter
@@ -17,18 +21,67 @@ sqlite3.register_adapter(datetime, adapt_datetime)
 sqlite3.register_converter("DATETIME", convert_datetime)
 
 
+def normalize_name(name: Optional[str]) -> str:
+    """
+    Trim a name and collapse runs of whitespace, so "Ken " and " Ken" are stored the same way.
+    """
+    return " ".join((name or "").split())
+
+
+def name_key(name: Optional[str]) -> str:
+    """
+    The key people are matched on, ignoring case and whitespace differences.
+    """
+    return normalize_name(name).casefold()
+
+
+def expense_fingerprint(amount, description, owed_to, owed_from, date_created) -> str:
+    """
+    A stable hash of an expense's content, used to recognize the same expense when it's imported again.
+
+    Names are compared by name_key(), and timestamps by their parsed value, so an exported CSV fingerprints the same
+    as the rows it was exported from.
+    """
+    if isinstance(date_created, str):
+        try:
+            date_created = datetime.fromisoformat(date_created.strip())
+        except ValueError:
+            date_created = date_created.strip()
+    if isinstance(date_created, datetime):
+        date_created = date_created.isoformat()
+
+    content = "\x1f".join(
+        [repr(float(amount)), (description or "").strip(), name_key(owed_to), name_key(owed_from), str(date_created)]
+    )
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
 class Table:
-    def __init__(self, db: "Database", table_name: str, columns: Dict[str, str]) -> None:
+    def __init__(
+        self,
+        db: "Database",
+        table_name: str,
+        columns: Dict[str, str],
+        view_name: Optional[str] = None,
+        view_columns: Optional[List[str]] = None,
+        order_by: Optional[str] = None,
+    ) -> None:
         """
         Initialize a Table object.
 
         :param db: The Database object this table belongs to.
         :param table_name: The name of the table.
         :param columns: A dictionary mapping column names to their SQL data types.
+        :param view_name: The name of a view to select rows from instead of the table, if any.
+        :param view_columns: Columns of the view to select when none are given. Defaults to the table's columns.
+        :param order_by: An ORDER BY expression for selected rows, if any.
         """
         self.db = db
         self.table_name = table_name
         self.columns = columns
+        self.view_name = view_name
+        self.view_columns = view_columns
+        self.order_by = order_by
 
     def create(self) -> None:
         """
@@ -54,17 +107,7 @@ class Table:
 
         :param where: Conditions for the WHERE clause.
         """
-        where_clause = ""
-        values = []
-
-        if where:
-            conditions = []
-            for k, v in where.items():
-                conditions.append(f"{k} = ?")
-                values.append(v)
-
-            where_clause = "WHERE " + " AND ".join(conditions)
-
+        where_clause, values = self._where_clause(where)
         sql = f"DELETE FROM {self.table_name} {where_clause}"
         self.db.cursor.execute(sql, values)
 
@@ -77,46 +120,139 @@ class Table:
         :return: A list of dictionaries representing the rows.
         """
         if not columns:
-            columns = self.columns.keys()
-
-        where_clause = ""
-        values = []
+            columns = self.view_columns or self.columns.keys()
 
-        if where:
-            conditions = []
-            for k, v in where.items():
-                if k.endswith("__contains"):
-                    column_name = k.removesuffix("__contains")
-                    conditions.append(f"{column_name} LIKE ?")
-                    values.append(f"%{v}%")
-                elif k.endswith("__gt"):
-                    column_name = k.removesuffix("__gt")
-                    conditions.append(f"{column_name} > ?")
-                    values.append(v)
-                elif k.endswith("__gte"):
-                    column_name = k.removesuffix("__gte")
-                    conditions.append(f"{column_name} >= ?")
-                    values.append(v)
-                elif k.endswith("__lt"):
-                    column_name = k.removesuffix("__lt")
-                    conditions.append(f"{column_name} < ?")
-                    values.append(v)
-                elif k.endswith("__lte"):
-                    column_name = k.removesuffix("__lte")
-                    conditions.append(f"{column_name} <= ?")
-                    values.append(v)
-                else:
-                    conditions.append(f"{k} = ?")
-                    values.append(v)
-
-            where_clause = "WHERE " + " AND ".join(conditions)
-
-        sql = f"SELECT {', '.join(columns)} FROM {self.table_name} {where_clause}"
+        where_clause, values = self._where_clause(where)
+        sql = f"SELECT {', '.join(columns)} FROM {self.view_name or self.table_name} {where_clause}"
+        if self.order_by:
+            sql += f" ORDER BY {self.order_by}"
         self.db.cursor.execute(sql, values)
         return [dict(row) for row in self.db.cursor.fetchall()]
 
+    def _where_clause(self, where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        """
+        Build a WHERE clause from keyword conditions.
+
+        :param where: Conditions, optionally suffixed with __contains, __gt, __gte, __lt or __lte.
+        :return: The WHERE clause, or an empty string if there are no conditions, and its parameter values.
+        """
+        if not where:
+            return "", []
+
+        conditions = []
+        values = []
+        for k, v in where.items():
+            if k.endswith("__contains"):
+                column_name = k.removesuffix("__contains")
+                conditions.append(f"{column_name} LIKE ?")
+                values.append(f"%{v}%")
+            elif k.endswith("__gt"):
+                column_name = k.removesuffix("__gt")
+                conditions.append(f"{column_name} > ?")
+                values.append(v)
+            elif k.endswith("__gte"):
+                column_name = k.removesuffix("__gte")
+                conditions.append(f"{column_name} >= ?")
+                values.append(v)
+            elif k.endswith("__lt"):
+                column_name = k.removesuffix("__lt")
+                conditions.append(f"{column_name} < ?")
+                values.append(v)
+            elif k.endswith("__lte"):
+                column_name = k.removesuffix("__lte")
+                conditions.append(f"{column_name} <= ?")
+                values.append(v)
+            else:
+                conditions.append(f"{k} = ?")
+                values.append(v)
+
+        return "WHERE " + " AND ".join(conditions), values
+
+
+class PersonTable(Table):
+    def __init__(self, db: "Database") -> None:
+        super().__init__(
+            db,
+            "person",
+            {
+                "id": "INTEGER PRIMARY KEY",
+                "name": "TEXT NOT NULL",
+                "name_key": "TEXT NOT NULL UNIQUE",
+            },
+        )
+
+        # In-memory copies of the table, kept up to date as people are added: a lookup by name_key, and a sorted
+        # list of (name_key, name) for prefix searches with bisect.
+        self._by_key: Dict[str, Tuple[int, str]] = {}
+        self._prefix_index: List[Tuple[str, str]] = []
+
+    def load(self) -> None:
+        """
+        Rebuild the in-memory lookups from the table, eg, after a restore or a rollback.
+        """
+        self._by_key = {row["name_key"]: (row["id"], row["name"]) for row in self.select()}
+        self._prefix_index = sorted((key, name) for key, (_, name) in self._by_key.items())
+
+    def get(self, name: str) -> Optional[Tuple[int, str]]:
+        """
+        Look up a person by name.
+
+        :param name: The name, in any case or spacing.
+        :return: The person's id and canonical name, or None if they don't exist.
+        """
+        return self._by_key.get(name_key(name))
+
+    def get_or_create(self, name: str) -> Tuple[int, str]:
+        """
+        Look up a person by name, adding them if they don't exist yet.
+
+        :param name: The name, in any case or spacing. The first spelling seen becomes the canonical name.
+        :return: The person's id and canonical name.
+        """
+        key = name_key(name)
+        if key not in self._by_key:
+            canonical_name = normalize_name(name)
+            self.insert(name=canonical_name, name_key=key)
+            self._by_key[key] = (self.db.cursor.lastrowid, canonical_name)
+            insort(self._prefix_index, (key, canonical_name))
+        return self._by_key[key]
+
+    def canonical_name(self, name: str) -> str:
+        """
+        Get the stored spelling of a name, or the normalized name if the person doesn't exist.
+        """
+        person = self.get(name)
+        return person[1] if person else normalize_name(name)
+
+    def names(self) -> List[str]:
+        """
+        Get the canonical names of everyone ever added, sorted.
+        """
+        return [name for _, name in self._prefix_index]
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """
+        Find names starting with a prefix, for autocomplete.
+
+        :param prefix: The start of a name, in any case or spacing.
+        :param limit: Maximum number of names to return.
+        :return: Matching canonical names, sorted.
+        """
+        key = name_key(prefix)
+        if not key:
+            return []
+
+        matches = []
+        for i in range(bisect_left(self._prefix_index, (key,)), len(self._prefix_index)):
+            if len(matches) >= limit or not self._prefix_index[i][0].startswith(key):
+                break
+            matches.append(self._prefix_index[i][1])
+        return matches
+
 
 class ExpenseTable(Table):
+    history_cache_size = 32
+
     def __init__(self, db: "Database") -> None:
         super().__init__(
             db,
@@ -125,16 +261,189 @@ class ExpenseTable(Table):
                 "id": "INTEGER PRIMARY KEY",
                 "amount": "REAL",
                 "description": "TEXT",
-                "owed_to": "TEXT",
-                "owed_from": "TEXT",
+                "owed_to_id": "INTEGER REFERENCES person (id)",
+                "owed_from_id": "INTEGER REFERENCES person (id)",
                 "date_created": "DATETIME",
+                "fingerprint": "TEXT",
+                "epoch": "INTEGER NOT NULL DEFAULT 0",
+                "deleted_at": "DATETIME",
             },
+            # People are stored by id. Rows are read through a view that joins their names back in, and that hides
+            # deleted rows and rows from before the last time everything was cleared.
+            view_name="expense_named",
+            view_columns=["id", "amount", "description", "owed_to", "owed_from", "date_created"],
+            order_by="id",
+        )
+
+        # Per-person generation counters, bumped whenever an expense involving that person changes. Cached histories
+        # are keyed on (person, generation), so stale entries are never returned and age out of the LRU.
+        self.generations: Dict[str, int] = {}
+        self._history_cache: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
+
+    def create(self) -> None:
+        super().create()
+        self.create_indexes()
+        self.create_view()
+
+    def create_indexes(self) -> None:
+        """
+        Create the indexes used by the view, get_history(), insert_expenses() and Database.compact().
+        """
+        # Live expenses by who's owed and who owes, for get_history(). The first also covers summary(), so totals per
+        # pair are read off the index in order, without touching the table.
+        self.db.cursor.execute(
+            f"""
+            CREATE INDEX expense_live_pair
+            ON {self.table_name} (epoch, owed_to_id, owed_from_id, amount)
+            WHERE deleted_at IS NULL
+            """
+        )
+        self.db.cursor.execute(
+            f"""
+            CREATE INDEX expense_live_owed_from_id
+            ON {self.table_name} (owed_from_id, epoch)
+            WHERE deleted_at IS NULL
+            """
+        )
+
+        # Fingerprints only need to be unique among live rows, so deleted or cleared expenses can be imported again
+        self.db.cursor.execute(
+            f"""
+            CREATE UNIQUE INDEX expense_live_fingerprint
+            ON {self.table_name} (epoch, fingerprint)
+            WHERE deleted_at IS NULL
+            """
+        )
+        self.db.cursor.execute(
+            f"""
+            CREATE INDEX expense_deleted_at
+            ON {self.table_name} (deleted_at)
+            WHERE deleted_at IS NOT NULL
+            """
+        )
+
+    def create_view(self) -> None:
+        """
+        Create the view rows are selected from.
+        """
+        self.db.cursor.execute(
+            f"""
+            CREATE VIEW {self.view_name} AS
+            SELECT
+                expense.id,
+                expense.amount,
+                expense.description,
+                owed_to.name AS owed_to,
+                owed_from.name AS owed_from,
+                expense.date_created,
+                expense.owed_to_id,
+                expense.owed_from_id
+            FROM
+                {self.table_name} AS expense
+                JOIN {self.db.person.table_name} AS owed_to ON owed_to.id = expense.owed_to_id
+                JOIN {self.db.person.table_name} AS owed_from ON owed_from.id = expense.owed_from_id
+            WHERE
+                expense.deleted_at IS NULL
+                AND expense.epoch = (SELECT epoch FROM {self.db.ledger.table_name} WHERE cleared_at IS NULL)
+            """
         )
 
+    def insert(self, **data) -> None:
+        people = []
+        for column in ("owed_to", "owed_from"):
+            if column in data:
+                person_id, person_name = self.db.person.get_or_create(data.pop(column))
+                data[f"{column}_id"] = person_id
+                people.append(person_name)
+        data.setdefault("epoch", self.db.epoch)
+        super().insert(**data)
+        self.bump_generation(*people)
+
+        row_id = self.db.cursor.lastrowid
+        self.db.journal({"action": "insert", "first_id": row_id, "last_id": row_id, "people": people})
+
+    def delete(self, **where) -> None:
+        """
+        Delete rows from the table. Rows are only marked as deleted, so the deletion can be undone; Database.compact()
+        removes them for good later.
+
+        With no conditions, every row is cleared at once by starting a new epoch, without touching the rows.
+
+        :param where: Conditions for the WHERE clause.
+        """
+        if not where:
+            self._history_cache.clear()
+            self.db.journal({"action": "clear", "epoch": self.db.epoch})
+            self.db.clear_epoch(datetime.now(timezone.utc))
+            return
+
+        rows = self.select("id", "owed_to", "owed_from", **where)
+        if not rows:
+            return
+
+        people = set()
+        for row in rows:
+            people.update((row["owed_to"], row["owed_from"]))
+        ids = [row["id"] for row in rows]
+        self.set_deleted(ids, datetime.now(timezone.utc))
+        self.bump_generation(*people)
+        self.db.journal({"action": "delete", "ids": ids, "people": list(people)})
+
+    def set_deleted(self, ids: List[int], deleted_at: Optional[datetime]) -> None:
+        """
+        Mark rows as deleted, or pass None for deleted_at to restore them.
+
+        :param ids: The ids of the rows.
+        :param deleted_at: When the rows were deleted, or None.
+        """
+        self.db.cursor.executemany(
+            f"UPDATE {self.table_name} SET deleted_at = ? WHERE id = ?", [(deleted_at, row_id) for row_id in ids]
+        )
+
+    def set_range_deleted(self, first_id: int, last_id: int, deleted_at: Optional[datetime]) -> None:
+        """
+        Like set_deleted(), for a range of ids, eg, the rows added by one import.
+        """
+        self.db.cursor.execute(
+            f"UPDATE {self.table_name} SET deleted_at = ? WHERE id BETWEEN ? AND ?", (deleted_at, first_id, last_id)
+        )
+
+    def bump_generation(self, *people: str) -> None:
+        """
+        Invalidate cached histories for the given people, leaving everyone else's cache entries valid.
+
+        :param people: Names of the people whose expenses changed.
+        """
+        for person in people:
+            self.generations[person] = self.generations.get(person, 0) + 1
+
     def summary(self):
+        # Totals are added up per pair of person ids first, so names are only joined in once per pair, not per row
         self.db.cursor.execute(
             f"""
-            WITH DebtSummary AS (
+            WITH PairTotal AS (
+                SELECT
+                    owed_to_id,
+                    owed_from_id,
+                    SUM(amount) AS amount
+                FROM
+                    {self.table_name}
+                WHERE
+                    epoch = ? AND deleted_at IS NULL
+                GROUP BY
+                    owed_to_id, owed_from_id
+            ),
+            NamedPairTotal AS (
+                SELECT
+                    owed_to.name AS owed_to,
+                    owed_from.name AS owed_from,
+                    PairTotal.amount
+                FROM
+                    PairTotal
+                    JOIN {self.db.person.table_name} AS owed_to ON owed_to.id = PairTotal.owed_to_id
+                    JOIN {self.db.person.table_name} AS owed_from ON owed_from.id = PairTotal.owed_from_id
+            ),
+            DebtSummary AS (
                 SELECT 
                     CASE 
                         WHEN owed_to < owed_from THEN owed_to 
@@ -151,7 +460,7 @@ class ExpenseTable(Table):
                         END
                     ) AS net_amount
                 FROM 
-                    {self.table_name}
+                    NamedPairTotal
                 GROUP BY 
                     person1, person2
             )
@@ -166,72 +475,552 @@ class ExpenseTable(Table):
             FROM 
                 DebtSummary
             WHERE 
-                net_amount <> 0;
-            """
+                net_amount <> 0
+            ORDER BY
+                person1, person2;
+            """,
+            (self.db.epoch,),
         )
 
         return [dict(row) for row in self.db.cursor.fetchall()]
 
     def get_history(self, person):
+        person = self.db.person.get(person)
+        if not person:
+            return []
+
+        # Each side is looked up in its own person index. The second leaves out expenses someone owes themselves, which
+        # the first already found.
         self.db.cursor.execute(
             f"""
             SELECT 
-                amount,
-                description,
-                owed_to,
-                owed_from,
-                date_created
+                expense.amount,
+                expense.description,
+                owed_to.name AS owed_to,
+                owed_from.name AS owed_from,
+                expense.date_created
             FROM 
-                {self.table_name}
-            WHERE 
-                owed_to = ? OR owed_from = ?
+                (
+                    SELECT amount, description, owed_to_id, owed_from_id, date_created
+                    FROM {self.table_name}
+                    WHERE owed_to_id = :person_id AND epoch = :epoch AND deleted_at IS NULL
+                    UNION ALL
+                    SELECT amount, description, owed_to_id, owed_from_id, date_created
+                    FROM {self.table_name}
+                    WHERE
+                        owed_from_id = :person_id
+                        AND owed_to_id <> :person_id
+                        AND epoch = :epoch
+                        AND deleted_at IS NULL
+                ) AS expense
+                JOIN {self.db.person.table_name} AS owed_to ON owed_to.id = expense.owed_to_id
+                JOIN {self.db.person.table_name} AS owed_from ON owed_from.id = expense.owed_from_id
             ORDER BY 
-                date_created DESC;
+                expense.date_created DESC;
             """,
-            (person, person),
+            {"person_id": person[0], "epoch": self.db.epoch},
         )
 
         return [dict(row) for row in self.db.cursor.fetchall()]
 
+    def get_cached_history(self, person: str) -> List[Dict[str, Any]]:
+        """
+        Get a person's history, newest first, with a running balance on each row.
+
+        The balance is from the person's point of view: positive means they are owed money. Results are cached until
+        an expense involving the person changes.
+
+        :param person: The person's name.
+        :return: A list of dictionaries representing the rows, each with an extra "balance" key.
+        """
+        person = self.db.person.canonical_name(person)
+        key = (person, self.generations.get(person, 0))
+        if key in self._history_cache:
+            self._history_cache.move_to_end(key)
+            return self._history_cache[key]
+
+        history = self.get_history(person)
+        balance = 0
+        for row in reversed(history):
+            # Expenses someone owes themselves don't change their balance
+            if row["owed_to"] != row["owed_from"]:
+                balance += row["amount"] if row["owed_to"] == person else -row["amount"]
+            row["balance"] = balance
+
+        self._history_cache[key] = history
+        if len(self._history_cache) > self.history_cache_size:
+            self._history_cache.popitem(last=False)
+        return history
+
     def insert_expense(self, amount, description, owed_to, owed_from, date_created=None):
+        date_created = date_created or datetime.now(timezone.utc)
         self.insert(
             amount=amount,
             description=description,
             owed_to=owed_to,
             owed_from=owed_from,
-            date_created=date_created or datetime.now(timezone.utc),
+            date_created=date_created,
+            fingerprint=expense_fingerprint(amount, description, owed_to, owed_from, date_created),
         )
 
-    def get_unique_names(self):
+    def insert_expenses(self, expenses: List[Dict[str, Any]]) -> int:
+        """
+        Insert a batch of expenses, skipping any whose content is already in the table or earlier in the batch.
+
+        Existing expenses are found with a single lookup on the fingerprint index, so importing a file again only
+        costs as much as the rows that are new. Keep batches to a few hundred rows, to stay under SQLite's limit on
+        query parameters.
+
+        :param expenses: Dictionaries with amount, description, owed_to, owed_from and, optionally, date_created.
+        :return: The number of expenses inserted.
+        """
+        new_expenses = {}
+        for expense in expenses:
+            expense = dict(expense, date_created=expense.get("date_created") or datetime.now(timezone.utc))
+            fingerprint = expense_fingerprint(
+                expense["amount"],
+                expense["description"],
+                expense["owed_to"],
+                expense["owed_from"],
+                expense["date_created"],
+            )
+            new_expenses.setdefault(fingerprint, expense)
+        if not new_expenses:
+            return 0
+
+        placeholders = ", ".join("?" * len(new_expenses))
         self.db.cursor.execute(
             f"""
-            SELECT DISTINCT owed_to
+            SELECT fingerprint
             FROM {self.table_name}
-            UNION
-            SELECT DISTINCT owed_from
-            FROM {self.table_name};
-            """
+            WHERE epoch = ? AND fingerprint IN ({placeholders}) AND deleted_at IS NULL
+            """,
+            [self.db.epoch, *new_expenses],
         )
-        return [row["owed_to"] for row in self.db.cursor.fetchall()]
+        for row in self.db.cursor.fetchall():
+            del new_expenses[row["fingerprint"]]
+        if not new_expenses:
+            return 0
+
+        people = set()
+        values = []
+        for fingerprint, expense in new_expenses.items():
+            owed_to_id, owed_to = self.db.person.get_or_create(expense["owed_to"])
+            owed_from_id, owed_from = self.db.person.get_or_create(expense["owed_from"])
+            people.update((owed_to, owed_from))
+            values.append(
+                (
+                    expense["amount"],
+                    expense["description"],
+                    owed_to_id,
+                    owed_from_id,
+                    expense["date_created"],
+                    fingerprint,
+                    self.db.epoch,
+                )
+            )
+
+        # Rows get consecutive ids after the current highest one, so the batch can be journaled as a range
+        self.db.cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 AS first_id FROM {self.table_name}")
+        first_id = self.db.cursor.fetchone()["first_id"]
+        self.db.cursor.executemany(
+            f"""
+            INSERT INTO {self.table_name} (
+                id, amount, description, owed_to_id, owed_from_id, date_created, fingerprint, epoch
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(first_id + i, *row) for i, row in enumerate(values)],
+        )
+        self.bump_generation(*people)
+        self.db.journal(
+            {"action": "insert", "first_id": first_id, "last_id": first_id + len(values) - 1, "people": list(people)}
+        )
+        return len(values)
+
+    def get_unique_names(self):
+        return self.db.person.names()
 
 
 class Database:
-    def __init__(self, existing_db: Optional[str] = None) -> None:
+    # How long changes can be undone for. After that, Database.compact() removes deleted rows for good.
+    undo_window = timedelta(minutes=10)
+
+    def __init__(self, existing_db: Optional[str] = None, create_tables: bool = True) -> None:
         """
         Initialize a Database object.
 
         :param existing_db: SQL script to initialize the database with existing data, if any.
+        :param create_tables: Whether to create empty tables when no existing data is given. Pass False when the
+            data will be loaded later with restore().
         """
         self.conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
         self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
 
+        # The ledger table has a row per epoch. Only the current one has no cleared_at. Expenses from earlier epochs have
+        # been cleared, and are kept until compact() finds they were cleared longer than undo_window ago.
+        self.ledger = Table(self, "ledger", {"epoch": "INTEGER PRIMARY KEY", "cleared_at": "DATETIME"})
+        self.epoch = 0
+
+        # Operations that can be undone or redone, oldest first. Each is a dict with a list of "steps", and the "time"
+        # it was last done, undone or redone. _operation collects the steps of an operation in progress.
+        self.undo_stack: List[Dict[str, Any]] = []
+        self.redo_stack: List[Dict[str, Any]] = []
+        self._operation: Optional[Dict[str, Any]] = None
+
+        # Copies of both stacks as of the last commit, for rollback() to go back to
+        self._committed_journal: Tuple[List[Dict[str, Any]], List[Dict[str, Any]]] = ([], [])
+
+        # Whether migrate() had to change the last snapshot loaded, which should then be saved again
+        self.migrated = False
+
+        self.person = PersonTable(self)
         self.expense = ExpenseTable(self)
 
         if existing_db:
             self.conn.executescript(existing_db)
+            self.migrate()
+        elif create_tables:
+            self.create_tables()
+
+    def create_tables(self) -> None:
+        """
+        Create empty tables.
+        """
+        self.ledger.create()
+        self.ledger.insert(epoch=self.epoch)
+        self.person.create()
+        self.expense.create()
+
+    def migrate(self) -> bool:
+        """
+        Bring data loaded from a snapshot that stored names directly on expenses up to the current schema, and load
+        in-memory lookups.
+
+        :return: Whether the snapshot was migrated, in which case it should be saved again.
+        """
+        for _ in self._migrate():
+            pass
+        return self.migrated
+
+    def _migrate(self, chunk_size: int = 500) -> Iterator[None]:
+        """
+        Like migrate(), but a generator that yields between steps and between chunks of rows, so restore() can hand
+        control back to the event loop while a large snapshot is migrated. Sets migrated when done.
+        """
+        self.cursor.execute(f"PRAGMA table_info({self.expense.table_name})")
+        self.migrated = "owed_to" in {row["name"] for row in self.cursor.fetchall()}
+        if self.migrated:
+            self.ledger.create()
+            self.ledger.insert(epoch=self.epoch)
+            self.person.create()
+            yield from self._migrate_expense_names(chunk_size)
+            yield from self._migrate_fingerprints(chunk_size)
+
+        self.load_epoch()
+        self.person.load()
+        self.commit()
+
+    def _migrate_expense_names(self, chunk_size: int) -> Iterator[None]:
+        """
+        Move expenses from snapshots that stored names directly onto the person table, a chunk of rows at a time.
+        """
+        self.cursor.execute(f"ALTER TABLE {self.expense.table_name} RENAME TO expense_old")
+        self.expense.create()
+
+        # The spelling on the earliest expense becomes the canonical name
+        self.cursor.execute(
+            """
+            SELECT name
+            FROM (
+                SELECT id * 2 AS position, COALESCE(owed_to, '') AS name FROM expense_old
+                UNION ALL
+                SELECT id * 2 + 1, COALESCE(owed_from, '') FROM expense_old
+            )
+            GROUP BY name
+            ORDER BY MIN(position)
+            """
+        )
+        names = [row["name"] for row in self.cursor.fetchall()]
+        self.cursor.execute("CREATE TEMP TABLE person_alias (name TEXT PRIMARY KEY, person_id INTEGER)")
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO person_alias VALUES (?, ?)",
+            [(name, self.person.get_or_create(name)[0]) for name in names],
+        )
+        yield
+
+        last_id = 0
+        while True:
+            self.cursor.execute(
+                f"""
+                INSERT INTO {self.expense.table_name} (id, amount, description, owed_to_id, owed_from_id, date_created)
+                SELECT
+                    expense_old.id,
+                    expense_old.amount,
+                    expense_old.description,
+                    owed_to.person_id,
+                    owed_from.person_id,
+                    expense_old.date_created
+                FROM
+                    expense_old
+                    JOIN person_alias AS owed_to ON owed_to.name = COALESCE(expense_old.owed_to, '')
+                    JOIN person_alias AS owed_from ON owed_from.name = COALESCE(expense_old.owed_from, '')
+                WHERE
+                    expense_old.id > ?
+                ORDER BY
+                    expense_old.id
+                LIMIT ?
+                """,
+                (last_id, chunk_size),
+            )
+            if self.cursor.rowcount < chunk_size:
+                break
+            last_id = self.cursor.lastrowid
+            yield
+        self.cursor.execute("DROP TABLE expense_old")
+        self.cursor.execute("DROP TABLE person_alias")
+
+    def _migrate_fingerprints(self, chunk_size: int) -> Iterator[None]:
+        """
+        Fingerprint expenses from snapshots that predate fingerprints, a chunk of rows at a time. If a snapshot already
+        holds duplicates, only the first copy gets the fingerprint; the rest are left without one.
+        """
+        seen = set()
+        last_id = 0
+        while True:
+            self.cursor.execute(
+                f"""
+                SELECT id, amount, description, owed_to, owed_from, date_created
+                FROM {self.expense.view_name}
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (last_id, chunk_size),
+            )
+            rows = self.cursor.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for row in rows:
+                fingerprint = expense_fingerprint(
+                    row["amount"], row["description"], row["owed_to"], row["owed_from"], row["date_created"]
+                )
+                if fingerprint not in seen:
+                    seen.add(fingerprint)
+                    updates.append((fingerprint, row["id"]))
+            self.cursor.executemany(f"UPDATE {self.expense.table_name} SET fingerprint = ? WHERE id = ?", updates)
+            last_id = rows[-1]["id"]
+            yield
+
+    def commit(self) -> None:
+        """
+        Commit the current transaction, along with the steps journaled during it.
+        """
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self._committed_journal = (self.undo_stack.copy(), self.redo_stack.copy())
+
+    def begin(self) -> None:
+        """
+        Start a transaction for rollback() to roll back to, committing earlier changes so they stay in step with the
+        undo stack.
+        """
+        self.commit()
+        self.conn.execute("BEGIN TRANSACTION;")
+
+    def rollback(self) -> None:
+        """
+        Roll back the current transaction, including people added and steps journaled during it.
+        """
+        self.conn.rollback()
+        self.undo_stack[:] = self._committed_journal[0]
+        self.redo_stack[:] = self._committed_journal[1]
+        self.load_epoch()
+        self.person.load()
+        self.expense._history_cache.clear()
+        if self._operation is not None:
+            self._operation["steps"] = []
+
+    def load_epoch(self) -> None:
+        """
+        Read the current epoch from the ledger table. Only expenses added during the current epoch are visible.
+        """
+        self.cursor.execute(f"SELECT epoch FROM {self.ledger.table_name} WHERE cleared_at IS NULL")
+        self.epoch = self.cursor.fetchone()["epoch"]
+
+    def clear_epoch(self, cleared_at: datetime) -> None:
+        """
+        Clear every expense at once by starting a new epoch.
+
+        :param cleared_at: When the current epoch was cleared. compact() removes its expenses once this is older than
+            undo_window.
+        """
+        self.cursor.execute(
+            f"UPDATE {self.ledger.table_name} SET cleared_at = ? WHERE epoch = ?", (cleared_at, self.epoch)
+        )
+        self.cursor.execute(
+            f"INSERT OR REPLACE INTO {self.ledger.table_name} (epoch, cleared_at) VALUES (?, NULL)", (self.epoch + 1,)
+        )
+        self.epoch += 1
+
+    def restore_epoch(self, epoch: int) -> None:
+        """
+        Go back to an earlier epoch, undoing clear_epoch(). Later epochs are forgotten.
+        """
+        self.cursor.execute(f"DELETE FROM {self.ledger.table_name} WHERE epoch > ?", (epoch,))
+        self.cursor.execute(
+            f"INSERT OR REPLACE INTO {self.ledger.table_name} (epoch, cleared_at) VALUES (?, NULL)", (epoch,)
+        )
+        self.epoch = epoch
+
+    @contextmanager
+    def operation(self) -> Iterator[None]:
+        """
+        Group every change made inside the block into one operation, so they're undone and redone together.
+        """
+        if self._operation is not None:
+            yield
+            return
+
+        self._operation = {"steps": []}
+        try:
+            yield
+        finally:
+            operation, self._operation = self._operation, None
+            if operation["steps"]:
+                self._push_operation(operation["steps"])
+
+    def journal(self, step: Dict[str, Any]) -> None:
+        """
+        Record a change so it can be undone. Tables call this as they change rows.
+
+        :param step: A dict with an "action" of "insert", "delete" or "clear", and what's needed to reverse it.
+        """
+        if self._operation is not None:
+            self._operation["steps"].append(step)
         else:
-            self.expense.create()
+            self._push_operation([step])
+
+    def _push_operation(self, steps: List[Dict[str, Any]]) -> None:
+        self.undo_stack.append({"steps": steps, "time": datetime.now(timezone.utc)})
+        self.redo_stack.clear()
+
+    def undo(self) -> bool:
+        """
+        Undo the most recent operation.
+
+        :return: Whether there was anything to undo.
+        """
+        if not self.undo_stack:
+            return False
+
+        operation = self.undo_stack.pop()
+        operation["time"] = datetime.now(timezone.utc)
+        for step in reversed(operation["steps"]):
+            self._apply_step(step, undo=True, now=operation["time"])
+        self.redo_stack.append(operation)
+        return True
+
+    def redo(self) -> bool:
+        """
+        Redo the most recently undone operation.
+
+        :return: Whether there was anything to redo.
+        """
+        if not self.redo_stack:
+            return False
+
+        operation = self.redo_stack.pop()
+        operation["time"] = datetime.now(timezone.utc)
+        for step in operation["steps"]:
+            self._apply_step(step, undo=False, now=operation["time"])
+        self.undo_stack.append(operation)
+        return True
+
+    def _apply_step(self, step: Dict[str, Any], undo: bool, now: datetime) -> None:
+        if step["action"] == "insert":
+            self.expense.set_range_deleted(step["first_id"], step["last_id"], now if undo else None)
+            self.expense.bump_generation(*step["people"])
+        elif step["action"] == "delete":
+            self.expense.set_deleted(step["ids"], None if undo else now)
+            self.expense.bump_generation(*step["people"])
+        elif step["action"] == "clear":
+            if undo:
+                self.restore_epoch(step["epoch"])
+            else:
+                self.clear_epoch(now)
+            self.expense._history_cache.clear()
+        else:
+            raise ValueError(f"Unknown journal action: {step['action']}")
+
+    def compact(self, now: Optional[datetime] = None) -> int:
+        """
+        Forget operations older than the undo window, and remove the rows only they could have brought back.
+
+        :param now: The current time, for testing.
+        :return: The number of rows removed.
+        """
+        cutoff = (now or datetime.now(timezone.utc)) - self.undo_window
+
+        # Both stacks are ordered oldest first, so expired operations are always at the bottom
+        for stack in (self.undo_stack, self.redo_stack):
+            while stack and stack[0]["time"] < cutoff:
+                stack.pop(0)
+
+        # Rows deleted or cleared before the cutoff can't be restored any more, since whatever deleted them has expired.
+        # Both times are stored with the rows, so this holds for rows deleted before the snapshot was loaded, too.
+        self.cursor.execute(f"DELETE FROM {self.expense.table_name} WHERE deleted_at < ?", (cutoff,))
+        removed = self.cursor.rowcount
+        self.cursor.execute(
+            f"""
+            DELETE FROM {self.expense.table_name}
+            WHERE
+                epoch IN (SELECT epoch FROM {self.ledger.table_name} WHERE cleared_at < ?)
+                AND deleted_at IS NULL
+            """,
+            (cutoff,),
+        )
+        removed += self.cursor.rowcount
+        self.cursor.execute(f"DELETE FROM {self.ledger.table_name} WHERE cleared_at < ?", (cutoff,))
+        return removed
+
+    def restore(self, existing_db: str, chunk_size: int = 500) -> Iterator[float]:
+        """
+        Load a SQL script produced by to_string() a chunk of statements at a time.
+
+        This is a generator: after each chunk it yields the fraction of the script executed so far, so the caller can
+        report progress and hand control back to the event loop between chunks.
+
+        :param existing_db: SQL script representing the database.
+        :param chunk_size: Number of statements to execute between yields.
+        :return: An iterator of progress values, ending with 1.0.
+        """
+        total = len(existing_db) or 1
+        consumed = 0
+        executed = 0
+        statement = ""
+
+        for line in io.StringIO(existing_db):
+            consumed += len(line)
+            statement += line
+            if not sqlite3.complete_statement(statement):
+                continue
+
+            self.cursor.execute(statement)
+            statement = ""
+            executed += 1
+            if executed % chunk_size == 0:
+                yield consumed / total
+
+        if statement.strip():
+            self.cursor.execute(statement)
+        self.commit()
+        for _ in self._migrate(chunk_size):
+            yield consumed / total
+        yield 1.0
 
     def to_string(self) -> str:
         """
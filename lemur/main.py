@@ -1,9 +1,14 @@
+import asyncio
 import csv
 import io
+import json
 
-from puepy import Application, Page, t
+import puepy.core
+from puepy import Application, Component, Page, t
+from puepy.core import Tag
 from puepy.router import Router
-from puepy.runtime import is_server_side, add_event_listener
+from puepy.runtime import is_server_side, add_event_listener, remove_event_listener
+from puepy.util import jsobj, morphdom
 
 from lemur.expensedb import Database
 
@@ -15,253 +20,389 @@ class ExpenseLemurApp(Application):
     def initial(self):
         return {
             "loading": True,
+            "loading_progress": 0,
+            "load_error": None,
+            "known_people": [],
+            "expenses": [],
+            "summary": [],
+            "can_undo": False,
+            "can_redo": False,
         }
 
     def reload_db(self, save=True):
-        self.state["known_people"] = (db.expense.get_unique_names(),)
+        self.state["known_people"] = db.expense.get_unique_names()
         self.state["expenses"] = db.expense.select()
         self.state["summary"] = db.expense.summary()
         self.state["loading"] = False
+        self.update_undo_state()
         if save:
-            self.local_storage["db"] = db.to_string()
+            self.save()
+
+    def save(self):
+        self.local_storage["db"] = db.to_string()
+        self.local_storage["summary"] = json.dumps(self.state["summary"])
+
+    def update_undo_state(self):
+        self.state["can_undo"] = bool(db.undo_stack)
+        self.state["can_redo"] = bool(db.redo_stack)
+
+    async def compact_periodically(self, interval=60):
+        """
+        Every so often, forget changes that are too old to undo and remove the rows they deleted from storage.
+        """
+        while True:
+            try:
+                if db.compact():
+                    self.save()
+            except Exception as e:
+                # Nothing is lost if compaction stops; deleted rows just stay in storage
+                print("Compaction failed, not retrying:", e)
+                return
+            self.update_undo_state()
+            await asyncio.sleep(interval)
+
+    def load_cached_summary(self):
+        """
+        Show the summary saved alongside the last snapshot, so totals are visible before the ledger is loaded.
+        """
+        cached_summary = self.local_storage.get("summary")
+        if cached_summary:
+            self.state["summary"] = json.loads(cached_summary)
+
+    def start(self, existing_db):
+        """
+        Start loading the saved ledger in the background. The page shows progress, or an error if loading fails.
+        """
+        self.compact_task = None
+        self.hydrate_task = asyncio.ensure_future(self.hydrate(existing_db))
+
+    async def hydrate(self, existing_db):
+        """
+        Load the saved ledger in chunks, yielding to the browser between them so the page stays responsive.
+        """
+        try:
+            if existing_db:
+                for progress in db.restore(existing_db):
+                    self.state["loading_progress"] = progress
+                    await asyncio.sleep(0)
+            else:
+                db.create_tables()
+            # Save a migrated snapshot right away, so the migration doesn't run again on every launch
+            self.reload_db(save=db.migrated)
+        except Exception as e:
+            self.state["load_error"] = str(e) or e.__class__.__name__
+            return
+        self.compact_task = asyncio.ensure_future(self.compact_periodically())
 
 
 app = ExpenseLemurApp()
 existing_data = app.local_storage.get("db")
-db = Database(existing_data)
-app.reload_db(save=False)
+db = Database(create_tables=False)
+app.load_cached_summary()
 app.install_router(Router, link_mode=Router.LINK_MODE_HASH)
-app.local_storage.get("db")
 
 
-@app.page("/")
-class DefaultPage(Page):
-    default_classes = ["flex", "flex-col", "flex-grow"]
+def patch_memoized(source_element, target_element):
+    """
+    Patch the page the way puepy does, except that elements standing in for unchanged MemoizedComponents are skipped,
+    leaving what's already on the page as it is.
+    """
+    return morphdom.default(target_element, source_element, patch_memoized_options)
 
-    def initial(self):
-        return {"import_error": None, "import_message": None}
 
-    def populate(self):
-        th_classes = "py-2 px-4 font-medium text-gray-500 uppercase tracking-wider"
-        td_classes = "py-2 px-4 text-gray-700"
+if morphdom:
+    patch_memoized_options = jsobj(
+        onBeforeElUpdated=js.Function.new("fromEl", "toEl", "return !toEl.hasAttribute('data-memoized');")
+    )
+    puepy.core.patch_dom_element = patch_memoized
+
+
+def forget_detached_listeners(tag):
+    """
+    Remove event listeners a tag and its children added to elements that are no longer on the page.
 
-        if self.application.state["loading"]:
-            with t.div(
-                style="text-align: center; height: 100vh; display: flex; justify-content: center; align-items: center;"
-            ):
-                t.sl_spinner(style="font-size: 50px; --track-width: 10px;")
+    Tags reused across redraws render onto a new staging element each time, and keep a record of every listener they
+    added to one. Once patching has thrown the staging element away, the record only keeps it alive.
+    """
+    if is_server_side:
+        return
+
+    attached = []
+    for listener in tag._added_event_listeners:
+        if listener[0].isConnected:
+            attached.append(listener)
         else:
-            with t.header(classes="flex justify-between items-center bg-white p-4 mb-4 shadow-lg"):
-                t.sl_avatar(image="/img/icon/launchericon-512-512.png", label="Expense Lemur")
+            remove_event_listener(*listener)
+    tag._added_event_listeners = attached
 
-                t.h1(
-                    " Expense Lemur",
-                    classes="text-4xl font-bold",
-                    style="color: rgb(149 96 40)",
-                )
+    for child in tag.children:
+        if isinstance(child, Tag) and not getattr(child, "_memo_hit", False):
+            forget_detached_listeners(child)
 
-                with t.sl_dropdown(on_sl_select=self.on_menu_select):
-                    t.sl_icon_button(name="gear", label="Settings", slot="trigger")
-                    with t.sl_menu():
-                        t.sl_menu_item(t.sl_icon(slot="prefix", name="box-arrow-down"), "Download CSV", value="export")
-                        t.sl_menu_item(t.sl_icon(slot="prefix", name="upload"), "Import CSV", value="import")
-                        t.sl_divider()
-                        t.sl_menu_item(t.sl_icon(slot="prefix", name="x-circle"), "Clear All", value="clear_all")
-                        t.sl_divider()
-                        t.sl_menu_item(t.sl_icon(slot="prefix", name="info-lg"), "About", value="about")
-            with t.main(classes="flex-grow container mx-auto p-4"):
-                with t.div(classes="container mx-auto"):
-                    if self.application.state["expenses"]:
-                        with t.table(classes="table-auto w-full"):
-                            t.thead(
-                                t.tr(
-                                    t.th("Owed By", classes=th_classes),
-                                    t.th("Owed To", classes=th_classes),
-                                    t.th("Description", classes=th_classes),
-                                    t.th("Date/Amount", classes=th_classes),
-                                    t.th(""),
-                                ),
-                            )
-                            with t.tbody():
-                                for expense in self.application.state["expenses"]:
-                                    t.tr(
-                                        t.td(expense["owed_from"], classes=td_classes),
-                                        t.td(expense["owed_to"], classes=td_classes),
-                                        t.td(expense["description"], classes=td_classes),
-                                        t.td(
-                                            expense["date_created"].strftime("%Y-%m-%d %H:%M %Z"),
-                                            t.br(),
-                                            t.sl_format_number(
-                                                type="currency",
-                                                currency="USD",
-                                                value=str(expense["amount"]),
-                                                lang="en-US",
-                                                style="font-weight: bold",
-                                            ),
-                                            classes=td_classes,
-                                        ),
-                                        t.td(
-                                            t.sl_button(
-                                                t.sl_icon(name="trash3"),
-                                                size="small",
-                                                circle=True,
-                                                data_id=expense["id"],
-                                                on_click=self.on_delete_click,
-                                            ),
-                                            classes="text-right " + td_classes,
-                                        ),
-                                        classes="border-t border-gray-300",
-                                    )
-                    else:
-                        with t.div(classes="bg-white p-6 rounded-lg shadow-lg"):
-                            t.div("No expenses yet... Why not buy a coffee? ☕️", classes="text-center p-12 text-2xl")
-                if self.application.state["summary"]:
-                    t.br()
-                    with t.div(classes="bg-white p-6 rounded-lg shadow-lg"):
-                        with t.h2(classes="text-xl font-bold mb-6 text-center"):
-                            t("Summary")
-                        with t.table(classes="table-auto w-full"):
-                            t.thead(t.tr(t.th("Payment"), t.th("Amount")))
-                            with t.tbody():
-                                for summary in self.application.state["summary"]:
-                                    t.tr(
-                                        t.td(summary["direction"]),
-                                        t.td(
-                                            t.sl_format_number(
-                                                type="currency",
-                                                currency="USD",
-                                                value=str(summary["total_amount"]),
-                                                lang="en-US",
-                                            )
-                                        ),
-                                    )
-                    t.br()
-                    with t.div(classes="text-right"):
-                        t.sl_button("Clear All", size="small", variant="text", on_click=self.on_show_clear_all_click)
-
-            # Extra bottom padding. For mobile Safari, I couldn't figure out a better solution...
-            t.br()
-            t.br()
-            t.br()
-            with t.footer(classes="p-6"):
-                t.sl_button(
-                    "Add",
-                    classes="w-full shadow-lg",
-                    variant="primary",
-                    size="large",
-                    on_click=self.on_add_click,
-                )
 
-            self.populate_add_item_drawer()
-            self.populate_clear_all_dialog()
-            self.populate_export_dialog()
-            self.populate_import_dialog()
-            self.populate_about_dialog()
+class MemoizedComponent(Component):
+    """
+    A component that keeps its children between parent redraws, only running populate() again when memo_key()
+    changes or the component redraws itself.
+
+    While nothing has changed, it renders as an empty element with the same id, which patch_memoized() skips. Neither
+    rendering nor patching then touches its children.
+    """
+
+    _memo_key = None
+    _memo_children = None
+    _memo_hit = False
+
+    def memo_key(self):
+        return self.props_values
+
+    def generate_children(self):
+        memo_key = self.memo_key()
+        self._memo_hit = self._memo_children is not None and memo_key == self._memo_key
+        if self._memo_hit:
+            self.children = self._memo_children.copy()
+            return
+
+        super().generate_children()
+        self._memo_key = memo_key
+        self._memo_children = self.children.copy()
+
+    def render(self):
+        if self._memo_hit and morphdom and self.document.getElementById(self.element_id):
+            element = self._create_element(self.attrs)
+            element.setAttribute("data-memoized", "")
+            return element
+        return super().render()
+
+    def redraw(self):
+        self._memo_children = None
+        super().redraw()
+        forget_detached_listeners(self)
+
+
+@t.component()
+class ExpenseRow(MemoizedComponent):
+    enclosing_tag = "tr"
+    default_classes = ["border-t", "border-gray-300"]
+    props = ["expense"]
+
+    def populate(self):
+        td_classes = "py-2 px-4 text-gray-700"
+
+        t.td(self.person_link(self.expense["owed_from"]), classes=td_classes)
+        t.td(self.person_link(self.expense["owed_to"]), classes=td_classes)
+        t.td(self.expense["description"], classes=td_classes)
+        t.td(
+            self.expense["date_created"].strftime("%Y-%m-%d %H:%M %Z"),
+            t.br(),
+            t.sl_format_number(
+                type="currency",
+                currency="USD",
+                value=str(self.expense["amount"]),
+                lang="en-US",
+                style="font-weight: bold",
+            ),
+            classes=td_classes,
+        )
+        t.td(
+            t.sl_button(t.sl_icon(name="trash3"), size="small", circle=True, on_click=self.on_delete_click),
+            classes="text-right " + td_classes,
+        )
+
+    def person_link(self, person):
+        return t.a(
+            person,
+            href=self.router.reverse(PersonHistoryPage, person=person),
+            classes="hover:text-blue-700 hover:underline",
+        )
 
     def on_delete_click(self, event):
-        db.expense.delete(id=event.currentTarget.getAttribute("data-id"))
+        db.expense.delete(id=self.expense["id"])
         self.application.reload_db()
 
-    def on_menu_select(self, event):
-        if event.detail.item.value == "clear_all":
-            self.refs["clear_all_dialog"].element.show()
-        elif event.detail.item.value == "export":
-            self.export_csv_file()
-        elif event.detail.item.value == "import":
-            self.refs["import_dialog"].element.show()
-        elif event.detail.item.value == "about":
-            self.refs["about_dialog"].element.show()
-        else:
-            print(f"Unknown menu item: {event.detail.item.value}")
 
-    ##
-    ## Add Item Drawer and Events
-    ##
-    def populate_add_item_drawer(self):
-        with t.sl_drawer(ref="add_item_dialog", placement="bottom", label="Add Expense"):
-            with t.form(id="iou-form", classes="space-y-4", on_submit=self.on_add_submit, ref="add_form"):
-                with t.div(classes="flex"):
-                    t.sl_input(label="From", classes="w-1/2 p-2", placeholder="Person who owes money", ref="from")
-                    t.sl_input(label="To", classes="w-1/2 p-2", placeholder="Person who is owed money", ref="to")
+@t.component()
+class SummaryTable(MemoizedComponent):
+    redraw_on_app_state_changes = ["summary", "loading"]
 
-                with t.div(classes="flex"):
-                    t.sl_input(label="Amount", classes="w-1/4 p-2", type="number", ref="amount")
-                    t.sl_input(label="Description", classes="w-3/4 p-2", ref="description")
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.add_context("app", self.application.state)
+
+    def memo_key(self):
+        return self.application.state["summary"], self.application.state["loading"]
+
+    def populate(self):
+        if not self.application.state["summary"]:
+            return
+
+        t.br()
+        with t.div(classes="bg-white p-6 rounded-lg shadow-lg"):
+            with t.h2(classes="text-xl font-bold mb-6 text-center"):
+                t("Summary")
+            with t.table(classes="table-auto w-full"):
+                t.thead(t.tr(t.th("Payment"), t.th("Amount")))
+                with t.tbody():
+                    for summary in self.application.state["summary"]:
+                        t.tr(
+                            t.td(summary["direction"]),
+                            t.td(
+                                t.sl_format_number(
+                                    type="currency",
+                                    currency="USD",
+                                    value=str(summary["total_amount"]),
+                                    lang="en-US",
+                                )
+                            ),
+                        )
+        if not self.application.state["loading"]:
+            t.br()
+            with t.div(classes="text-right"):
+                t.sl_button("Clear All", size="small", variant="text", on_click=self.on_show_clear_all_click)
+
+    def on_show_clear_all_click(self, event):
+        self.page.refs["clear_all_dialog"].element.show()
+
+
+@t.component()
+class PersonInput(MemoizedComponent):
+    """
+    A text input that suggests names of people already in the ledger as you type.
+    """
+
+    props = ["label", "placeholder"]
+
+    def initial(self):
+        return {"suggestions": []}
+
+    def populate(self):
+        with t.sl_dropdown(
+            open=bool(self.state["suggestions"]), on_sl_select=self.on_suggestion_select, classes="w-full"
+        ):
+            t.sl_input(
+                label=self.label,
+                placeholder=self.placeholder,
+                slot="trigger",
+                autocomplete="off",
+                ref="input",
+                on_sl_input=self.on_input,
+            )
+            with t.sl_menu():
+                for name in self.state["suggestions"]:
+                    t.sl_menu_item(name, value=name)
 
-                with t.sl_button(type="submit", variant="primary", classes="w-full"):
-                    t("Save Expense")
+    @property
+    def value(self):
+        return self.refs["input"].element.value
+
+    def on_input(self, event):
+        self.state["suggestions"] = [name for name in db.person.complete(self.value) if name != self.value]
+
+    def on_suggestion_select(self, event):
+        self.refs["input"].element.value = event.detail.item.value
+        self.state["suggestions"] = []
+
+    def reset(self):
+        """
+        Clear the input and close any suggestions, eg, after the form it's in is saved.
+        """
+        self.refs["input"].element.value = ""
+        self.state["suggestions"] = []
+
+
+@t.component()
+class AddExpenseDrawer(MemoizedComponent):
+    enclosing_tag = "sl-drawer"
+    default_attrs = {"placement": "bottom", "label": "Add Expense"}
+
+    def populate(self):
+        with t.form(id="iou-form", classes="space-y-4", on_submit=self.on_add_submit, ref="add_form"):
+            with t.div(classes="flex"):
+                t.person_input(label="From", classes="w-1/2 p-2", placeholder="Person who owes money", ref="from")
+                t.person_input(label="To", classes="w-1/2 p-2", placeholder="Person who is owed money", ref="to")
+
+            with t.div(classes="flex"):
+                t.sl_input(label="Amount", classes="w-1/4 p-2", type="number", ref="amount")
+                t.sl_input(label="Description", classes="w-3/4 p-2", ref="description")
+
+            with t.sl_button(type="submit", variant="primary", classes="w-full"):
+                t("Save Expense")
 
     def on_add_submit(self, event):
         event.preventDefault()
         db.expense.insert_expense(
             amount=float(self.refs["amount"].element.value),
             description=self.refs["description"].element.value,
-            owed_to=self.refs["to"].element.value,
-            owed_from=self.refs["from"].element.value,
+            owed_to=self.refs["to"].value,
+            owed_from=self.refs["from"].value,
         )
-        self.refs["add_item_dialog"].element.hide()
+        self.element.hide()
         self.refs["add_form"].element.reset()
+        self.refs["from"].reset()
+        self.refs["to"].reset()
         self.application.reload_db()
 
-    def on_add_click(self, event):
-        self.refs["add_item_dialog"].element.show()
 
-    ##
-    ## Clear all dialog and events
-    ##
-    def populate_clear_all_dialog(self):
-        with t.sl_dialog(ref="clear_all_dialog", label="Clear All"):
-            t("Are you sure you want to delete all transactions? This cannot be undone.")
-            t.sl_button("Clear All", slot="footer", variant="warning", on_click=self.on_clear_all_click)
-            t.sl_button("Cancel", slot="footer", variant="text", on_click=self.on_hide_clear_all_click)
+@t.component()
+class ClearAllDialog(MemoizedComponent):
+    enclosing_tag = "sl-dialog"
+    default_attrs = {"label": "Clear All"}
+
+    def populate(self):
+        t("Are you sure you want to delete all transactions? You can undo this for a few minutes afterwards.")
+        t.sl_button("Clear All", slot="footer", variant="warning", on_click=self.on_clear_all_click)
+        t.sl_button("Cancel", slot="footer", variant="text", on_click=self.on_hide_clear_all_click)
 
     def on_clear_all_click(self, event):
         db.expense.delete()
         self.application.reload_db()
-        self.refs["clear_all_dialog"].element.hide()
+        self.element.hide()
 
     def on_hide_clear_all_click(self, event):
-        self.refs["clear_all_dialog"].element.hide()
+        self.element.hide()
 
-    def on_show_clear_all_click(self, event):
-        self.refs["clear_all_dialog"].element.show()
-
-    ##
-    ## Import dialog and events
-    ##
-    def populate_import_dialog(self):
-        with t.sl_dialog(ref="import_dialog", label="Import CSV"):
-            if self.state["import_message"]:
-                with t.sl_alert(open=True):
-                    t.sl_icon(name="info-circle")
-                    t(" ", self.state["import_message"])
-            else:
-                t(
-                    "This will import a CSV file of your expenses. The file should have columns for owed_from, owed_to,"
-                    " description, amount, and date_created."
-                )
-                with t.form(on_submit=self.on_import_submit, ref="import_form"):
-                    t.input(type="file", label="Select CSV file", ref="import_file", classes="p-4")
-                    t.sl_checkbox("Clear existing data", ref="erase")
-                if self.state["import_error"]:
-                    with t.sl_alert(open=True, variant="danger"):
-                        t.sl_icon(name="exclamation-triangle")
-                        t(self.state["import_error"])
-                t.sl_button(
-                    "Import",
-                    ref="import_submit",
-                    slot="footer",
-                    type="submit",
-                    variant="primary",
-                    on_click=self.on_import_submit,
-                )
+
+@t.component()
+class ImportDialog(MemoizedComponent):
+    enclosing_tag = "sl-dialog"
+    default_attrs = {"label": "Import CSV"}
+    batch_size = 500
+
+    def initial(self):
+        return {"import_error": None, "import_message": None}
+
+    def populate(self):
+        if self.state["import_message"]:
+            with t.sl_alert(open=True):
+                t.sl_icon(name="info-circle")
+                t(" ", self.state["import_message"])
+        else:
+            t(
+                "This will import a CSV file of your expenses. The file should have columns for owed_from, owed_to,"
+                " description, amount, and date_created."
+            )
+            with t.form(on_submit=self.on_import_submit, ref="import_form"):
+                t.input(type="file", label="Select CSV file", ref="import_file", classes="p-4")
+                t.sl_checkbox("Clear existing data", ref="erase")
+            if self.state["import_error"]:
+                with t.sl_alert(open=True, variant="danger"):
+                    t.sl_icon(name="exclamation-triangle")
+                    t(self.state["import_error"])
             t.sl_button(
-                "Close", ref="import_close", slot="footer", variant="text", on_click=self.on_close_import_dialog_click
+                "Import",
+                ref="import_submit",
+                slot="footer",
+                type="submit",
+                variant="primary",
+                on_click=self.on_import_submit,
             )
+        t.sl_button(
+            "Close", ref="import_close", slot="footer", variant="text", on_click=self.on_close_import_dialog_click
+        )
 
     def on_close_import_dialog_click(self, event):
         event.preventDefault()
-        self.refs["import_dialog"].element.hide()
+        self.element.hide()
 
     async def on_import_submit(self, event):
         event.preventDefault()
@@ -276,54 +417,71 @@ class DefaultPage(Page):
             ab = await file.arrayBuffer()
             fd = io.StringIO(ab.to_bytes().decode("utf-8"))
             reader = csv.DictReader(fd)
-            db.conn.execute("BEGIN TRANSACTION;")
-            if self.refs["erase"].element.checked:
-                db.conn.execute("DELETE FROM expense;")
-            for i, row in enumerate(reader):
-                try:
-                    db.expense.insert_expense(
-                        amount=float(row["amount"]),
-                        description=row["description"],
-                        owed_to=row["owed_to"],
-                        owed_from=row["owed_from"],
-                        date_created=row["date_created"],
-                    )
-                except KeyError:
-                    self.state["import_error"] = f"Error on row {i+1}: Columns do not match expected columns"
-                    db.conn.rollback()
-                    return
-                except (ValueError, TypeError):
-                    self.state["import_error"] = f"Error on row {i+1}: Invalid data in row"
-                    db.conn.rollback()
-                    return
+            db.begin()
+            with db.operation():  # So the whole import is undone in one step
+                if self.refs["erase"].element.checked:
+                    db.expense.delete()
+                inserted = skipped = 0
+                batch = []
+                for i, row in enumerate(reader):
+                    try:
+                        batch.append(
+                            {
+                                "amount": float(row["amount"]),
+                                "description": row["description"],
+                                "owed_to": row["owed_to"],
+                                "owed_from": row["owed_from"],
+                                "date_created": row["date_created"],
+                            }
+                        )
+                    except KeyError:
+                        self.state["import_error"] = f"Error on row {i+1}: Columns do not match expected columns"
+                        db.rollback()
+                        return
+                    except (ValueError, TypeError):
+                        self.state["import_error"] = f"Error on row {i+1}: Invalid data in row"
+                        db.rollback()
+                        return
+                    if len(batch) >= self.batch_size:
+                        batch_inserted = db.expense.insert_expenses(batch)
+                        inserted += batch_inserted
+                        skipped += len(batch) - batch_inserted
+                        batch = []
+                batch_inserted = db.expense.insert_expenses(batch)
+                inserted += batch_inserted
+                skipped += len(batch) - batch_inserted
             self.application.reload_db()
-            self.state["import_message"] = "Import successful"
-            # self.refs["import_dialog"].element.hide()
+            if skipped:
+                self.state["import_message"] = f"Imported {inserted} expenses, skipped {skipped} already in the ledger"
+            else:
+                self.state["import_message"] = f"Imported {inserted} expenses"
+            # self.element.hide()
 
-    ##
-    ## Download dialog and events
-    ##
 
-    def populate_export_dialog(self):
-        with t.sl_dialog(ref="export_dialog", label="Download CSV"):
-            t(
-                "This will export a CSV file of your expenses, which you can open as a spreadsheet,"
-                " share with friends, or import again to Expense Lemur."
+@t.component()
+class ExportDialog(MemoizedComponent):
+    enclosing_tag = "sl-dialog"
+    default_attrs = {"label": "Download CSV"}
+
+    def populate(self):
+        t(
+            "This will export a CSV file of your expenses, which you can open as a spreadsheet,"
+            " share with friends, or import again to Expense Lemur."
+        )
+        if "export_url" in self.state:
+            t.sl_button(
+                "Download",
+                slot="footer",
+                variant="primary",
+                href=self.state["export_url"],
+                download="expenses.csv",
             )
-            if "export_url" in self.state:
-                t.sl_button(
-                    "Download",
-                    slot="footer",
-                    variant="primary",
-                    href=self.state["export_url"],
-                    download="expenses.csv",
-                )
-            else:
-                t.sl_spinner()
-            t.sl_button("Close", slot="footer", variant="text", on_click=self.on_close_export_dialog_click)
+        else:
+            t.sl_spinner()
+        t.sl_button("Close", slot="footer", variant="text", on_click=self.on_close_export_dialog_click)
 
     def on_close_export_dialog_click(self, event):
-        self.refs["export_dialog"].element.hide()
+        self.element.hide()
 
     def export_csv_file(self):
         field_names = ["owed_from", "owed_to", "description", "amount", "date_created"]
@@ -339,42 +497,259 @@ class DefaultPage(Page):
         blob = js.Blob.new([f.getvalue()], {"type": "text/csv"})
         self.state["export_url"] = js.URL.createObjectURL(blob)
 
-        self.refs["export_dialog"].element.show()
-
-    ##
-    ## About Dialog and events
-    ##
-    def populate_about_dialog(self):
-        with t.sl_dialog(ref="about_dialog", label="Expense Lemur"):
-            t.p("© Copyright 2024 Ken Kinder", classes="mb-4")
-            t.div(
-                """Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except 
-            in compliance with the License. You may obtain a copy of the License at""",
-                classes="mb-4",
-            )
-            t.p(
-                t.a("http://www.apache.org/licenses/LICENSE-2.0", href="http://www.apache.org/licenses/LICENSE-2.0"),
-                classes="mb-4 text-blue-500 hover:text-blue-700 underline",
-            )
-            t.p(
-                "Unless required by applicable law or agreed to in writing, software distributed under the License is"
-                ' distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or'
-                " implied. See the License for the specific language governing permissions and limitations under"
-                " the License.",
-                classes="mb-4",
+        self.element.show()
+
+
+@t.component()
+class AboutDialog(MemoizedComponent):
+    enclosing_tag = "sl-dialog"
+    default_attrs = {"label": "Expense Lemur"}
+
+    def populate(self):
+        t.p("© Copyright 2024 Ken Kinder", classes="mb-4")
+        t.div(
+            """Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except 
+        in compliance with the License. You may obtain a copy of the License at""",
+            classes="mb-4",
+        )
+        t.p(
+            t.a("http://www.apache.org/licenses/LICENSE-2.0", href="http://www.apache.org/licenses/LICENSE-2.0"),
+            classes="mb-4 text-blue-500 hover:text-blue-700 underline",
+        )
+        t.p(
+            "Unless required by applicable law or agreed to in writing, software distributed under the License is"
+            ' distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or'
+            " implied. See the License for the specific language governing permissions and limitations under"
+            " the License.",
+            classes="mb-4",
+        )
+        t.hr(classes="mb-4")
+        t.p(
+            "Expense Lemur is a simple app to track expenses between friends. It's a demo of ",
+            t.a("PeuPy", href="https://puepy.dev/", classes="text-blue-500 hover:text-blue-700 underline"),
+            " -- the reactive frontend framework for Python. See ",
+            t.a(
+                "github.com/kkinder/expenselemur",
+                href="https://github.com/kkinder/expenselemur",
+                classes="text-blue-500 hover:text-blue-700 underline",
+            ),
+        )
+
+
+@t.component()
+class LoadingPanel(Component):
+    """
+    Shows progress while the ledger is loading, or why it couldn't be loaded.
+    """
+
+    def populate(self):
+        with t.div(classes="bg-white p-6 rounded-lg shadow-lg"):
+            if self.application.state["load_error"]:
+                with t.sl_alert(open=True, variant="danger"):
+                    t.sl_icon(name="exclamation-triangle")
+                    t(" Your saved expenses couldn't be loaded: ", self.application.state["load_error"])
+            else:
+                t.div("Loading expenses...", classes="text-center pb-4 text-gray-500")
+                t.sl_progress_bar(value=round(self.application.state["loading_progress"] * 100))
+
+
+@app.page("/")
+class DefaultPage(Page):
+    default_classes = ["flex", "flex-col", "flex-grow"]
+    redraw_on_app_state_changes = ["loading", "loading_progress", "load_error", "expenses", "can_undo", "can_redo"]
+
+    def populate(self):
+        th_classes = "py-2 px-4 font-medium text-gray-500 uppercase tracking-wider"
+        loading = self.application.state["loading"]
+
+        with t.header(classes="flex justify-between items-center bg-white p-4 mb-4 shadow-lg"):
+            t.sl_avatar(image="/img/icon/launchericon-512-512.png", label="Expense Lemur")
+
+            t.h1(
+                " Expense Lemur",
+                classes="text-4xl font-bold",
+                style="color: rgb(149 96 40)",
             )
-            t.hr(classes="mb-4")
-            t.p(
-                "Expense Lemur is a simple app to track expenses between friends. It's a demo of ",
-                t.a("PeuPy", href="https://puepy.dev/", classes="text-blue-500 hover:text-blue-700 underline"),
-                " -- the reactive frontend framework for Python. See ",
-                t.a(
-                    "github.com/kkinder/expenselemur",
-                    href="https://github.com/kkinder/expenselemur",
-                    classes="text-blue-500 hover:text-blue-700 underline",
-                ),
+
+            with t.div(classes="flex items-center"):
+                t.sl_icon_button(
+                    name="arrow-counterclockwise",
+                    label="Undo",
+                    disabled=not self.application.state["can_undo"],
+                    on_click=self.on_undo_click,
+                )
+                t.sl_icon_button(
+                    name="arrow-clockwise",
+                    label="Redo",
+                    disabled=not self.application.state["can_redo"],
+                    on_click=self.on_redo_click,
+                )
+                with t.sl_dropdown(on_sl_select=self.on_menu_select, disabled=loading):
+                    t.sl_icon_button(name="gear", label="Settings", slot="trigger", disabled=loading)
+                    with t.sl_menu():
+                        t.sl_menu_item(t.sl_icon(slot="prefix", name="box-arrow-down"), "Download CSV", value="export")
+                        t.sl_menu_item(t.sl_icon(slot="prefix", name="upload"), "Import CSV", value="import")
+                        t.sl_divider()
+                        t.sl_menu_item(t.sl_icon(slot="prefix", name="x-circle"), "Clear All", value="clear_all")
+                        t.sl_divider()
+                        t.sl_menu_item(t.sl_icon(slot="prefix", name="info-lg"), "About", value="about")
+        with t.main(classes="flex-grow container mx-auto p-4"):
+            with t.div(classes="container mx-auto"):
+                if loading:
+                    t.loading_panel()
+                elif self.application.state["expenses"]:
+                    with t.table(classes="table-auto w-full"):
+                        t.thead(
+                            t.tr(
+                                t.th("Owed By", classes=th_classes),
+                                t.th("Owed To", classes=th_classes),
+                                t.th("Description", classes=th_classes),
+                                t.th("Date/Amount", classes=th_classes),
+                                t.th(""),
+                            ),
+                        )
+                        with t.tbody():
+                            # Rows are keyed by expense id, so unchanged rows are reused rather than rebuilt
+                            for expense in self.application.state["expenses"]:
+                                t.expense_row(expense=expense, ref=f"expense_{expense['id']}")
+                else:
+                    with t.div(classes="bg-white p-6 rounded-lg shadow-lg"):
+                        t.div("No expenses yet... Why not buy a coffee? ☕️", classes="text-center p-12 text-2xl")
+            t.summary_table(ref="summary_table")
+
+        # Nothing below can be used until the ledger has been loaded
+        if loading:
+            return
+
+        # Extra bottom padding. For mobile Safari, I couldn't figure out a better solution...
+        t.br()
+        t.br()
+        t.br()
+        with t.footer(classes="p-6"):
+            t.sl_button(
+                "Add",
+                classes="w-full shadow-lg",
+                variant="primary",
+                size="large",
+                on_click=self.on_add_click,
             )
 
+        t.add_expense_drawer(ref="add_item_dialog")
+        t.clear_all_dialog(ref="clear_all_dialog")
+        t.export_dialog(ref="export_dialog")
+        t.import_dialog(ref="import_dialog")
+        t.about_dialog(ref="about_dialog")
+
+    def redraw(self):
+        super().redraw()
+        forget_detached_listeners(self)
+
+    def on_menu_select(self, event):
+        if event.detail.item.value == "clear_all":
+            self.refs["clear_all_dialog"].element.show()
+        elif event.detail.item.value == "export":
+            self.refs["export_dialog"].export_csv_file()
+        elif event.detail.item.value == "import":
+            self.refs["import_dialog"].element.show()
+        elif event.detail.item.value == "about":
+            self.refs["about_dialog"].element.show()
+        else:
+            print(f"Unknown menu item: {event.detail.item.value}")
+
+    def on_add_click(self, event):
+        self.refs["add_item_dialog"].element.show()
+
+    def on_undo_click(self, event):
+        if db.undo():
+            self.application.reload_db()
+
+    def on_redo_click(self, event):
+        if db.redo():
+            self.application.reload_db()
+
+
+@app.page("/history")
+class PersonHistoryPage(Page):
+    default_classes = ["flex", "flex-col", "flex-grow"]
+    redraw_on_app_state_changes = ["loading", "loading_progress", "load_error", "expenses"]
+    props = ["person"]
+
+    def page_title(self):
+        return f"{db.person.canonical_name(self.person)} - Expense Lemur"
+
+    def populate(self):
+        th_classes = "py-2 px-4 font-medium text-gray-500 uppercase tracking-wider"
+        td_classes = "py-2 px-4 text-gray-700"
+        person = db.person.canonical_name(self.person)
+
+        with t.header(classes="flex justify-between items-center bg-white p-4 mb-4 shadow-lg"):
+            t.sl_icon_button(name="arrow-left", label="Back", href=self.router.reverse(DefaultPage))
+            t.h1(person, classes="text-4xl font-bold", style="color: rgb(149 96 40)")
+            t.sl_avatar(image="/img/icon/launchericon-512-512.png", label="Expense Lemur")
+
+        with t.main(classes="flex-grow container mx-auto p-4"):
+            if self.application.state["loading"]:
+                t.loading_panel()
+                return
+
+            history = db.expense.get_cached_history(person)
+            if not history:
+                with t.div(classes="bg-white p-6 rounded-lg shadow-lg"):
+                    t.div(f"No expenses for {person}.", classes="text-center p-12 text-2xl")
+                return
+
+            with t.div(classes="bg-white p-6 rounded-lg shadow-lg mb-4 text-center text-xl"):
+                t("Balance: ")
+                t.sl_format_number(
+                    type="currency",
+                    currency="USD",
+                    value=str(history[0]["balance"]),
+                    lang="en-US",
+                    style="font-weight: bold",
+                )
+
+            with t.table(classes="table-auto w-full"):
+                t.thead(
+                    t.tr(
+                        t.th("Date", classes=th_classes),
+                        t.th("Description", classes=th_classes),
+                        t.th("With", classes=th_classes),
+                        t.th("Amount", classes=th_classes),
+                        t.th("Balance", classes=th_classes),
+                    ),
+                )
+                with t.tbody():
+                    for row in history:
+                        if row["owed_to"] == row["owed_from"]:
+                            other, amount = row["owed_from"], 0
+                        elif row["owed_to"] == person:
+                            other, amount = row["owed_from"], row["amount"]
+                        else:
+                            other, amount = row["owed_to"], -row["amount"]
+                        t.tr(
+                            t.td(row["date_created"].strftime("%Y-%m-%d %H:%M %Z"), classes=td_classes),
+                            t.td(row["description"], classes=td_classes),
+                            t.td(
+                                t.a(
+                                    other,
+                                    href=self.router.reverse(PersonHistoryPage, person=other),
+                                    classes="hover:text-blue-700 hover:underline",
+                                ),
+                                classes=td_classes,
+                            ),
+                            t.td(
+                                t.sl_format_number(type="currency", currency="USD", value=str(amount), lang="en-US"),
+                                classes=td_classes,
+                            ),
+                            t.td(
+                                t.sl_format_number(
+                                    type="currency", currency="USD", value=str(row["balance"]), lang="en-US"
+                                ),
+                                classes=td_classes,
+                            ),
+                            classes="border-t border-gray-300",
+                        )
+
 
 if not is_server_side:
     from js import navigator, window
@@ -393,3 +768,4 @@ if not is_server_side:
         add_event_listener(window, "py:all-done", loader)
 
 app.mount("#app")
+app.start(existing_data)
@@ -150,10 +150,286 @@ class TestDatabaseAndTable(unittest.TestCase):
             ],
         )
 
+    def test_cached_history(self):
+        history = self.db.expense.get_cached_history("Ken")
+
+        self.assertListEqual([row["balance"] for row in history], [130.0, 80.0, 100.0])
+        self.assertIs(self.db.expense.get_cached_history("Ken"), history)
+
+    def test_cached_history_invalidation(self):
+        mike_history = self.db.expense.get_cached_history("Mike")
+
+        self.db.expense.insert_expense(amount=5.0, description="Coffee", owed_to="Ken", owed_from="Lily")
+        self.assertIs(self.db.expense.get_cached_history("Mike"), mike_history)
+        self.assertEqual(self.db.expense.get_cached_history("Ken")[0]["balance"], 135.0)
+
+        mike_history = self.db.expense.get_cached_history("Mike")
+        self.db.expense.delete(description="Tour")
+        self.assertIs(self.db.expense.get_cached_history("Mike"), mike_history)
+        self.assertEqual(len(self.db.expense.get_cached_history("Ken")), 3)
+
+        self.db.expense.delete()
+        self.assertListEqual(self.db.expense.get_cached_history("Mike"), [])
+
+    def test_cached_history_eviction(self):
+        self.db.expense.history_cache_size = 2
+        ken_history = self.db.expense.get_cached_history("Ken")
+        self.db.expense.get_cached_history("Lily")
+        self.db.expense.get_cached_history("Ken")
+        self.db.expense.get_cached_history("Steve")
+
+        self.assertIs(self.db.expense.get_cached_history("Ken"), ken_history)
+        self.assertEqual(len(self.db.expense._history_cache), 2)
+        self.assertNotIn(("Lily", self.db.expense.generations["Lily"]), self.db.expense._history_cache)
+
+    def test_history_and_summary_use_indexes(self):
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        self.db.expense.get_history("Ken")
+        self.db.expense.summary()
+        self.db.conn.set_trace_callback(None)
+
+        history_plan, summary_plan = (
+            [row["detail"] for row in self.db.conn.execute(f"EXPLAIN QUERY PLAN {sql}")] for sql in statements
+        )
+        # Plan wording varies between SQLite versions, so only check which indexes are used
+        self.assertTrue(any("expense_live_pair" in detail for detail in history_plan))
+        self.assertTrue(any("expense_live_owed_from_id" in detail for detail in history_plan))
+        self.assertTrue(any("expense_live_pair" in detail for detail in summary_plan))
+        for plan in (history_plan, summary_plan):
+            self.assertFalse(any(detail.startswith("SCAN") and "expense" in detail.split() for detail in plan))
+
+    def test_history_owed_to_self(self):
+        self.db.expense.insert_expense(amount=5.0, description="Snack", owed_to="Ken", owed_from="Ken")
+
+        self.assertEqual(len(self.db.expense.get_history("Ken")), 4)
+        history = self.db.expense.get_cached_history("Ken")
+        self.assertListEqual([row["balance"] for row in history], [130.0, 130.0, 80.0, 100.0])
+
     def test_get_unique_names(self):
         names = self.db.expense.get_unique_names()
         self.assertEqual(set(names), {"Ken", "Lily", "Mike", "Steve"})
 
+    def test_name_normalization(self):
+        self.db.expense.insert_expense(amount=30.0, description="Lunch", owed_to="ken ", owed_from=" LILY")
+
+        self.assertEqual(set(self.db.expense.get_unique_names()), {"Ken", "Lily", "Mike", "Steve"})
+        self.assertEqual(self.db.expense.select(description="Lunch")[0]["owed_to"], "Ken")
+        self.assertIn(
+            {"person1": "Ken", "person2": "Lily", "total_amount": 110.0, "direction": "Lily owes Ken"},
+            self.db.expense.summary(),
+        )
+        self.assertEqual(len(self.db.expense.get_history("  kEn")), 4)
+
+    def test_complete_names(self):
+        self.db.expense.insert_expense(amount=1.0, description="Gum", owed_to="Kendra", owed_from="Mary Ann")
+
+        self.assertListEqual(self.db.person.complete("ke"), ["Ken", "Kendra"])
+        self.assertListEqual(self.db.person.complete("KEND"), ["Kendra"])
+        self.assertListEqual(self.db.person.complete("m"), ["Mary Ann", "Mike"])
+        self.assertListEqual(self.db.person.complete("m", limit=1), ["Mary Ann"])
+        self.assertListEqual(self.db.person.complete("x"), [])
+        self.assertListEqual(self.db.person.complete(""), [])
+
+    def test_rollback_forgets_new_people(self):
+        self.db.commit()
+        self.db.expense.insert_expense(amount=1.0, description="Gum", owed_to="Zed", owed_from="Ken")
+        self.db.rollback()
+
+        self.assertIsNone(self.db.person.get("Zed"))
+        self.assertListEqual(self.db.person.complete("z"), [])
+        self.assertEqual(len(self.db.undo_stack), 7)
+
+    def test_insert_expenses_skips_duplicates(self):
+        expenses = [
+            {
+                "amount": 100.0,
+                "description": "Dinner",
+                "owed_to": "ken",
+                "owed_from": "Lily ",
+                "date_created": "2024-03-06 01:01:01",
+            },
+            {
+                "amount": 8.0,
+                "description": "Ice cream",
+                "owed_to": "Mike",
+                "owed_from": "Ken",
+                "date_created": "2024-03-09T10:00:00",
+            },
+            {
+                "amount": 8.0,
+                "description": "Ice cream",
+                "owed_to": "Mike",
+                "owed_from": "Ken",
+                "date_created": "2024-03-09T10:00:00",
+            },
+        ]
+
+        self.assertEqual(self.db.expense.insert_expenses(expenses), 1)
+        self.assertEqual(self.db.expense.insert_expenses(expenses), 0)
+        self.assertEqual(len(self.db.expense.select(description="Ice cream")), 1)
+        self.assertEqual(len(self.db.expense.select()), 8)
+
+    def test_insert_expenses_after_export(self):
+        exported = self.db.expense.select("amount", "description", "owed_to", "owed_from", "date_created")
+        for row in exported:
+            row["date_created"] = str(row["date_created"])
+
+        self.assertEqual(self.db.expense.insert_expenses(exported), 0)
+
+    def test_undo_redo_delete(self):
+        self.db.expense.delete(description="Tour")
+        self.assertEqual(len(self.db.expense.select()), 6)
+        self.assertEqual(len(self.db.expense.get_history("Ken")), 2)
+
+        self.assertTrue(self.db.undo())
+        ids = [row["id"] for row in self.db.expense.select()]
+        self.assertListEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(self.db.expense.get_cached_history("Ken")), 3)
+
+        self.assertTrue(self.db.redo())
+        self.assertEqual(len(self.db.expense.select()), 6)
+        self.assertFalse(self.db.redo())
+
+    def test_undo_redo_clear(self):
+        summary = self.db.expense.summary()
+        self.db.expense.delete()
+        self.db.expense.insert_expense(amount=5.0, description="Coffee", owed_to="Ken", owed_from="Lily")
+        self.assertEqual(len(self.db.expense.select()), 1)
+
+        self.db.undo()
+        self.db.undo()
+        self.assertListEqual(self.db.expense.summary(), summary)
+
+        self.db.redo()
+        self.assertListEqual(self.db.expense.select(), [])
+        self.db.redo()
+        self.assertEqual(len(self.db.expense.select()), 1)
+
+    def test_undo_import(self):
+        with self.db.operation():
+            self.db.expense.delete()
+            self.db.expense.insert_expenses(
+                [{"amount": 5.0, "description": "Coffee", "owed_to": "Ken", "owed_from": "Lily"}]
+            )
+        self.assertEqual(len(self.db.expense.select()), 1)
+
+        self.db.undo()
+        self.assertEqual(len(self.db.expense.select()), 7)
+        self.assertEqual(self.db.expense.select(description="Dinner")[0]["amount"], 100.0)
+
+    def test_rolled_back_operation_is_not_journaled(self):
+        self.db.begin()
+        with self.db.operation():
+            self.db.expense.delete()
+            self.db.expense.insert_expense(amount=5.0, description="Coffee", owed_to="Zed", owed_from="Lily")
+            self.db.rollback()
+
+        self.assertEqual(len(self.db.undo_stack), 7)
+        self.assertEqual(len(self.db.expense.select()), 7)
+        self.assertIsNone(self.db.person.get("Zed"))
+
+    def test_import_after_clear(self):
+        expenses = self.db.expense.select("amount", "description", "owed_to", "owed_from", "date_created")
+        self.db.expense.delete()
+
+        self.assertEqual(self.db.expense.insert_expenses(expenses), 7)
+        self.db.expense.delete(description="Tour")
+        self.assertEqual(self.db.expense.insert_expenses(expenses), 1)
+
+    def test_compact(self):
+        self.db.expense.delete(description="Tour")
+        self.db.expense.delete()
+        self.db.expense.insert_expense(amount=5.0, description="Coffee", owed_to="Ken", owed_from="Lily")
+
+        self.assertEqual(self.db.compact(), 0)
+        self.assertEqual(len(self.db.undo_stack), 10)
+
+        later = datetime.datetime.now(datetime.timezone.utc) + self.db.undo_window * 2
+        self.assertEqual(self.db.compact(now=later), 7)
+        self.assertListEqual(self.db.undo_stack, [])
+        self.assertEqual(len(self.db.expense.select()), 1)
+
+        self.db.expense.insert_expense(amount=3.0, description="Tea", owed_to="Ken", owed_from="Lily")
+        self.db.undo()
+        self.assertEqual(self.db.compact(now=later), 1)
+        self.assertFalse(self.db.redo())
+        self.assertListEqual([row["description"] for row in self.db.expense.select()], ["Coffee"])
+
+    def test_restore_keeps_deleted_rows(self):
+        self.db.expense.delete(description="Tour")
+        restored = Database(self.db.to_string())
+
+        self.assertListEqual(restored.expense.select(), self.db.expense.select())
+        self.assertEqual(restored.compact(), 0)
+        restored.conn.close()
+
+    def test_restore_keeps_cleared_rows(self):
+        self.db.expense.delete()
+        restored = Database(self.db.to_string())
+
+        self.assertEqual(restored.compact(), 0)
+        self.assertListEqual(restored.expense.select(), [])
+
+        later = datetime.datetime.now(datetime.timezone.utc) + self.db.undo_window * 2
+        self.assertEqual(restored.compact(now=later), 7)
+        self.assertListEqual(restored.ledger.select("epoch"), [{"epoch": 1}])
+        restored.conn.close()
+
+    def test_migrate_names_to_people(self):
+        old_db = "\n".join(
+            [
+                "BEGIN TRANSACTION;",
+                "CREATE TABLE expense (id INTEGER PRIMARY KEY, amount REAL, description TEXT, owed_to TEXT, "
+                "owed_from TEXT, date_created DATETIME);",
+                "INSERT INTO \"expense\" VALUES(1,10.0,'Dinner','Ken','lily','2024-03-06T01:01:01');",
+                "INSERT INTO \"expense\" VALUES(2,4.0,'Coffee','ken ','Lily','2024-03-07T01:01:01');",
+                "INSERT INTO \"expense\" VALUES(3,4.0,'Coffee','Ken','lily','2024-03-07T01:01:01');",
+                "COMMIT;",
+            ]
+        )
+        for db in (Database(old_db), Database(create_tables=False)):
+            if not db.person.names():
+                list(db.restore(old_db, chunk_size=2))
+
+            self.assertTrue(db.migrated)
+            self.assertListEqual(db.expense.get_unique_names(), ["Ken", "lily"])
+            self.assertEqual(db.expense.select(id=2)[0]["owed_to"], "Ken")
+            self.assertEqual(db.expense.select(id=2)[0]["date_created"], datetime.datetime(2024, 3, 7, 1, 1, 1))
+            self.assertListEqual(
+                db.expense.summary(),
+                [{"person1": "Ken", "person2": "lily", "total_amount": 18.0, "direction": "lily owes Ken"}],
+            )
+            coffee = {
+                "amount": 4.0,
+                "description": "Coffee",
+                "owed_to": "KEN",
+                "owed_from": "Lily",
+                "date_created": "2024-03-07T01:01:01",
+            }
+            self.assertEqual(db.expense.insert_expenses([coffee]), 0)
+            db.conn.close()
+
+    def test_restore_in_chunks(self):
+        self.db.expense.insert_expense(
+            amount=12.0,
+            description="Multi-line;\nnote",
+            owed_to="Ken",
+            owed_from="Mike",
+            date_created=datetime.datetime(year=2024, month=3, day=9, hour=12, minute=1, second=1),
+        )
+        restored = Database(create_tables=False)
+        progress = list(restored.restore(self.db.to_string(), chunk_size=2))
+
+        self.assertGreater(len(progress), 1)
+        self.assertListEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 1.0)
+        self.assertFalse(restored.migrated)
+        self.assertListEqual(restored.expense.select(), self.db.expense.select())
+        self.assertListEqual(restored.expense.summary(), self.db.expense.summary())
+        restored.conn.close()
+
 
 if __name__ == "__main__":
     unittest.main()